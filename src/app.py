@@ -1,5 +1,12 @@
 import os
-import json
+import re
+import sys
+import time
+import secrets
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice, repeat
 from flask import (
     Flask,
     render_template,
@@ -10,20 +17,53 @@ from flask import (
     redirect,
     url_for,
 )
-from file_lock import safe_read_json, safe_merge_json, safe_write_json
+from flask.json.provider import DefaultJSONProvider
+from file_lock import dumps_json, loads_json
 from bucket_manager import BucketManager
-from sites import get_sites, get_site_paths
+from sites import get_cached_sites, get_site_paths, get_sites
+from label_store import (
+    compact_labels,
+    get_labeled_keys,
+    read_labels,
+    read_sorted_labels,
+    update_labels,
+)
 from auth import (
     login_required,
     admin_required,
     validate_user,
     load_users,
+    load_users_with_index,
     save_users,
     get_user,
+    hash_password,
 )
 
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider using orjson (when installed) for jsonify and request bodies."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps_json(obj, default=self.default).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads_json(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Serialize straight to bytes, skipping the str round-trip
+        return self._app.response_class(
+            dumps_json(obj, default=self.default), mimetype=self.mimetype
+        )
+
+
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Required for sessions
+app.json = FastJSONProvider(app)
+app.secret_key = secrets.token_bytes(24)  # Required for sessions
 
 # Base directory for storage (configurable via environment variable)
 BASE_DIR = os.environ.get(
@@ -35,6 +75,159 @@ BASE_DIR = os.path.abspath(BASE_DIR)
 BUCKET_SIZE = int(os.environ.get("BUCKET_SIZE", 20))
 bucket_manager = BucketManager(BASE_DIR, BUCKET_SIZE)
 
+# Label value stored for images marked as empty/unreadable
+NULL_MARKER = sys.intern("__NULL__")
+
+# Session ids are 32 lowercase hex characters (secrets.token_hex(16))
+_is_session_id = re.compile(r"[0-9a-f]{32}").fullmatch
+
+# Form fields of /api/save that are not image labels
+SAVE_CONTROL_FIELDS = frozenset(("site", "session_id"))
+
+# Browser cache lifetime for captcha images (seconds)
+IMAGE_MAX_AGE = 31536000
+
+# Fields available on each /api/admin/images entry
+ADMIN_IMAGE_FIELDS = ("site", "filename", "value", "labeled_by", "admin_review")
+
+# Worker threads for loading several sites' labels at once
+_labels_read_pool = ThreadPoolExecutor(max_workers=8)
+
+# Minimum seconds between background maintenance runs for the same site
+CLEANUP_INTERVAL = 60.0
+_last_cleanup = {}  # site_id -> time.monotonic() of last scheduled run
+_pending_cleanup = set()  # site_ids with a deferred run already on a timer
+_cleanup_lock = threading.Lock()
+_cleanup_pool = ThreadPoolExecutor(max_workers=1)
+
+
+def _run_site_maintenance(site_id, labels_file):
+    """
+    Fold the site's edit journal into labels.json and clean up its buckets,
+    logging instead of raising on failure.
+    """
+    try:
+        compact_labels(labels_file)
+    except Exception:
+        logging.exception(f"Compacting labels for site {site_id} failed")
+    try:
+        bucket_manager.validate_and_cleanup_buckets(site_id, labels_file)
+    except Exception:
+        logging.exception(f"Bucket cleanup failed for site {site_id}")
+
+
+def _submit_site_maintenance(site_id, labels_file):
+    """Queue a deferred maintenance run once its timer fires."""
+    with _cleanup_lock:
+        _pending_cleanup.discard(site_id)
+        _last_cleanup[site_id] = time.monotonic()
+    _cleanup_pool.submit(_run_site_maintenance, site_id, labels_file)
+
+
+def schedule_site_maintenance(site_id, labels_file):
+    """
+    Queue journal compaction and bucket cleanup for a site on a background
+    thread, at most once per CLEANUP_INTERVAL. A call inside the interval
+    defers a single run to the end of it, so edits made just before the app
+    goes idle still reach labels.json within about CLEANUP_INTERVAL.
+
+    Args:
+        site_id: Site identifier
+        labels_file: Path to labels.json to compact and check completion
+    """
+    now = time.monotonic()
+    with _cleanup_lock:
+        last = _last_cleanup.get(site_id)
+        if last is not None and now - last < CLEANUP_INTERVAL:
+            if site_id not in _pending_cleanup:
+                _pending_cleanup.add(site_id)
+                timer = threading.Timer(
+                    CLEANUP_INTERVAL - (now - last),
+                    _submit_site_maintenance,
+                    (site_id, labels_file),
+                )
+                timer.daemon = True
+                timer.start()
+            return
+        _last_cleanup[site_id] = now
+    _cleanup_pool.submit(_run_site_maintenance, site_id, labels_file)
+
+
+# (site_id, session_id) -> images of the bucket last handed to that session,
+# so save() can check completion without another bucket lookup
+SESSION_BUCKETS_MAX = 10000
+_session_buckets = {}
+_session_buckets_lock = threading.Lock()
+
+
+def remember_session_bucket(site_id, session_id, bucket):
+    """
+    Record the bucket served to a session, evicting the oldest entry when full.
+
+    Args:
+        site_id: Site identifier
+        session_id: Session identifier
+        bucket: Bucket dictionary
+    """
+    key = (site_id, session_id)
+    images = tuple(bucket["images"])
+    with _session_buckets_lock:
+        _session_buckets.pop(key, None)
+        _session_buckets[key] = images
+        if len(_session_buckets) > SESSION_BUCKETS_MAX:
+            del _session_buckets[next(iter(_session_buckets))]
+
+
+def is_valid_site_id(site_id):
+    """
+    Check that a site id from the request is a usable folder name.
+
+    Args:
+        site_id: Site identifier from request arguments
+
+    Returns:
+        False if it isn't a string or get_site_paths would reject it,
+        True otherwise
+    """
+    if not isinstance(site_id, str):
+        return False
+    try:
+        get_site_paths(BASE_DIR, site_id)
+    except ValueError:
+        return False
+    return True
+
+
+def resolve_session_id(client_session_id=None, prefer_client=False, create=True):
+    """
+    Get the labeling session id, adopting a valid client-provided one if needed.
+
+    Args:
+        client_session_id: Session id sent by the client (URL, form or header)
+        prefer_client: Use a valid client id even if the session already has one
+        create: Generate a new id when neither the session nor the client has one
+
+    Returns:
+        Session id string, or None if there is none and create is False
+    """
+    client_valid = bool(client_session_id) and _is_session_id(client_session_id)
+    if prefer_client and client_valid:
+        session["session_id"] = client_session_id
+        return client_session_id
+
+    session_id = session.get("session_id")
+    if session_id:
+        return session_id
+
+    if client_valid:
+        session_id = client_session_id
+    elif create:
+        session_id = secrets.token_hex(16)
+    else:
+        return None
+    session["session_id"] = session_id
+    return session_id
+
 
 # Helper functions to handle both flat and nested label structures
 def get_label_value(label_data):
@@ -47,71 +240,147 @@ def get_label_value(label_data):
     Returns:
         String value or None
     """
-    if label_data is None:
-        return None
-    if isinstance(label_data, str):
-        return label_data
-    if isinstance(label_data, dict):
+    # json only produces exact dict/str instances, so identity checks suffice;
+    # the nested format is the common case and is tested first
+    data_type = type(label_data)
+    if data_type is dict:
         return label_data.get("value")
+    if data_type is str:
+        return label_data
     return None
 
 
-def is_labeled(label_data):
+def get_bucket_labels(bucket, all_labels):
     """
-    Check if image is labeled (handles both formats).
+    Get the label values for a bucket's images.
 
     Args:
-        label_data: Either a string (old format) or dict (new format)
+        bucket: Bucket dictionary
+        all_labels: Dictionary of labels for the site
 
     Returns:
-        True if labeled, False otherwise
+        Dict mapping each bucket image to its label value ("" if unlabeled)
     """
-    if label_data is None:
-        return False
-    if isinstance(label_data, str):
-        return True  # Any string value means labeled (including "__NULL__")
-    if isinstance(label_data, dict):
-        return "value" in label_data
-    return False
+    return {
+        img: get_label_value(all_labels.get(img)) or "" for img in bucket["images"]
+    }
 
 
-def get_admin_review(label_data):
+def build_admin_entry(site_id, filename, label_data):
     """
-    Get admin review data from label entry.
+    Build an admin review list entry for one label.
 
     Args:
+        site_id: Site identifier
+        filename: Image filename
         label_data: Either a string (old format) or dict (new format)
 
     Returns:
-        Dict with admin_review data or None
+        Entry dict (site, filename, value, labeled_by, admin_review)
     """
-    if isinstance(label_data, dict):
-        return label_data.get("admin_review")
-    return None
+    # Single format check instead of one per helper
+    if type(label_data) is dict:
+        value = label_data.get("value")
+        labeled_by = label_data.get("labeled_by")
+        admin_review = label_data.get("admin_review")
+    else:
+        value = label_data if type(label_data) is str else None
+        labeled_by = None
+        admin_review = None
+    return {
+        "site": site_id,
+        "filename": filename,
+        "value": value or "",
+        "labeled_by": labeled_by,
+        "admin_review": admin_review,
+    }
 
 
-def normalize_label_entry(filename, value, admin_review=None, labeled_by=None):
+def apply_admin_review(all_labels, review, reviewer_username):
     """
-    Create normalized label entry structure.
+    Apply one admin review to a site's labels in place.
 
     Args:
-        filename: Image filename
-        value: Label value (string or "__NULL__")
-        admin_review: Optional dict with admin review data
-        labeled_by: Optional username who labeled this
+        all_labels: Labels dictionary for the site (modified in place)
+        review: Review dict with filename, optional value and optional status
+        reviewer_username: Username of the reviewing admin
+    """
+    filename = review.get("filename")
+    value = review.get("value")
+    status = review.get("status")  # 'sure' or 'not_sure'
+
+    if not filename:
+        return
+
+    # Unpack the current entry once; flat entries carry no labeled_by/review
+    current_data = all_labels.get(filename)
+    is_nested = type(current_data) is dict
+    if is_nested:
+        old_value = current_data.get("value")
+        existing_labeled_by = current_data.get("labeled_by")
+        existing_review = current_data.get("admin_review")
+    else:
+        old_value = current_data if type(current_data) is str and current_data else None
+        existing_labeled_by = existing_review = None
+
+    # Determine new value (use provided value or keep existing). If the admin
+    # changed the value, labeled_by becomes the admin's name.
+    if value is not None:
+        new_value = value.strip() or NULL_MARKER
+        value_changed = new_value != old_value
+        labeled_by = reviewer_username if value_changed else existing_labeled_by
+    else:
+        new_value = old_value or NULL_MARKER
+        labeled_by = existing_labeled_by
+
+    # Update label entry - always use nested structure if admin_review exists
+    if status:
+        entry = {
+            "value": new_value,
+            "admin_review": {"status": status, "reviewed_by": reviewer_username},
+        }
+        if labeled_by:
+            entry["labeled_by"] = labeled_by
+    elif is_nested:
+        # Preserve existing structure
+        entry = {"value": new_value}
+        if labeled_by:
+            entry["labeled_by"] = labeled_by
+        if existing_review:
+            entry["admin_review"] = existing_review
+    elif labeled_by:
+        # Convert flat to nested now that we have labeled_by info
+        entry = {"value": new_value, "labeled_by": labeled_by}
+    else:
+        # Keep flat for backward compatibility
+        entry = new_value
+    all_labels[filename] = entry
 
-    Returns:
-        Dict with normalized structure
+
+def init_site_storage():
     """
-    entry = {"value": value}
-    if labeled_by:
-        entry["labeled_by"] = labeled_by
-    if admin_review:
-        entry["admin_review"] = admin_review
-    # If no admin_review and no labeled_by, return flat structure for backward compatibility
-    if not admin_review and not labeled_by:
-        return value
-    return entry
+    Create labels.json for every site found at startup and fold any leftover
+    edit journal into it. Also queues site maintenance per site, so buckets
+    finished before a restart are marked completed before the first request
+    needs them.
+    Request handlers rely on this (and on readers treating a missing file as
+    empty) instead of checking for the file on every request.
+    """
+    for site in get_sites(BASE_DIR):
+        labels_file = get_site_paths(BASE_DIR, site).labels
+        try:
+            with open(labels_file, "xb") as fp:
+                fp.write(b"{}")
+        except FileExistsError:
+            pass
+        try:
+            compact_labels(labels_file)
+        except Exception as e:
+            logging.error(f"Compacting labels for site {site} failed: {e}")
+        schedule_site_maintenance(site, labels_file)
+
+
+init_site_storage()
 
 
 # Authentication routes
@@ -152,7 +421,7 @@ def setup():
         # Create first user as admin
         new_user = {
             "username": username,
-            "password": password,
+            "password_hash": hash_password(password),
             "is_admin": True  # First user is always admin
         }
         
@@ -249,7 +518,7 @@ def get_current_user():
 def get_sites_list():
     """Get list of available sites."""
     try:
-        sites = get_sites(BASE_DIR)
+        sites = get_cached_sites(BASE_DIR)
         return jsonify({"success": True, "sites": sites})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -258,10 +527,18 @@ def get_sites_list():
 @app.route("/results/<site_id>/img/<path:filename>")
 def serve_image(site_id, filename):
     """Serve image from site's img directory."""
+    if not is_valid_site_id(site_id):
+        return jsonify({"success": False, "message": "Invalid site"}), 400
     try:
         paths = get_site_paths(BASE_DIR, site_id)
-        img_dir = paths["img"]
-        return send_from_directory(img_dir, filename)
+        img_dir = paths.img
+        # Captcha images never change once added, so let browsers keep them
+        # and revalidate with ETag/Last-Modified (304) instead of re-downloading
+        response = send_from_directory(
+            img_dir, filename, conditional=True, max_age=IMAGE_MAX_AGE
+        )
+        response.headers["Cache-Control"] = f"public, max-age={IMAGE_MAX_AGE}, immutable"
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 404
 
@@ -275,7 +552,7 @@ def index():
 
     # If no site specified, redirect to first available site or show site selector
     if not site_id:
-        sites = get_sites(BASE_DIR)
+        sites = get_cached_sites(BASE_DIR)
         if sites:
             username = session.get("username")
             is_admin = session.get("is_admin", False)
@@ -305,34 +582,35 @@ def index():
                 is_admin=is_admin,
             )
 
+    # Labels and buckets live in the site folder, which must already exist
+    if site_id not in get_cached_sites(BASE_DIR):
+        return render_template(
+            "index.html",
+            files=[],
+            labels={},
+            bucket=None,
+            session_id=None,
+            sites=get_cached_sites(BASE_DIR),
+            current_site=site_id,
+            username=session.get("username"),
+            is_admin=session.get("is_admin", False),
+        )
+
     # Get or assign bucket for this session (prefer session_id from URL so post-redirect load works)
-    session_id = request.args.get("session_id")
-    if session_id and len(session_id) == 32:
-        session["session_id"] = session_id
-    else:
-        session_id = session.get("session_id")
-    if not session_id:
-        session_id = os.urandom(16).hex()
-        session["session_id"] = session_id
+    session_id = resolve_session_id(request.args.get("session_id"), prefer_client=True)
 
     # Get site paths
     paths = get_site_paths(BASE_DIR, site_id)
-    labels_file = paths["labels"]
-
-    # Ensure labels file exists
-    if not os.path.exists(labels_file):
-        os.makedirs(os.path.dirname(labels_file), exist_ok=True)
-        with open(labels_file, "w") as fp:
-            json.dump({}, fp)
+    labels_file = paths.labels
 
-    # Validate and clean up orphaned buckets before getting bucket
-    bucket_manager.validate_and_cleanup_buckets(site_id, labels_file)
+    # Compact the journal and clean up orphaned buckets in the background
+    schedule_site_maintenance(site_id, labels_file)
 
     bucket = bucket_manager.get_bucket_for_session(session_id, site_id, labels_file)
 
     if bucket is None:
         # All buckets completed or no images
-        sites = get_sites(BASE_DIR)
+        sites = get_cached_sites(BASE_DIR)
         username = session.get("username")
         is_admin = session.get("is_admin", False)
         return render_template(
@@ -347,21 +625,12 @@ def index():
             is_admin=is_admin,
         )
 
+    remember_session_bucket(site_id, session_id, bucket)
+
     # Get labels for bucket images
-    labels = {}
-    if os.path.exists(labels_file):
-        try:
-            all_labels = safe_read_json(labels_file)
-            for img in bucket["images"]:
-                label_data = all_labels.get(img)
-                if label_data:
-                    labels[img] = get_label_value(label_data) or ""
-                else:
-                    labels[img] = ""
-        except:
-            pass
+    labels = get_bucket_labels(bucket, read_labels(labels_file))
 
-    sites = get_sites(BASE_DIR)
+    sites = get_cached_sites(BASE_DIR)
     username = session.get("username")
     is_admin = session.get("is_admin", False)
     return render_template(
@@ -385,32 +654,20 @@ def get_bucket():
     site_id = request.args.get("site")
     if not site_id:
         return jsonify({"success": False, "message": "Site parameter required"}), 400
+    if not is_valid_site_id(site_id):
+        return jsonify({"success": False, "message": "Invalid site"}), 400
+    if site_id not in get_cached_sites(BASE_DIR):
+        return jsonify({"success": False, "message": "Unknown site"}), 404
 
-    # Check if client sent session_id from localStorage
-    client_session_id = request.args.get("session_id")
-
-    session_id = session.get("session_id")
-    if not session_id:
-        # Try to use client-provided session_id if valid
-        if client_session_id and len(client_session_id) == 32:  # hex string length
-            session_id = client_session_id
-            session["session_id"] = session_id
-        else:
-            session_id = os.urandom(16).hex()
-            session["session_id"] = session_id
+    # Fall back to the session_id the client kept in localStorage
+    session_id = resolve_session_id(request.args.get("session_id"))
 
     # Get site paths
     paths = get_site_paths(BASE_DIR, site_id)
-    labels_file = paths["labels"]
+    labels_file = paths.labels
 
-    # Ensure labels file exists
-    if not os.path.exists(labels_file):
-        os.makedirs(os.path.dirname(labels_file), exist_ok=True)
-        with open(labels_file, "w") as fp:
-            json.dump({}, fp)
-
-    # Validate and clean up orphaned buckets before getting bucket
-    bucket_manager.validate_and_cleanup_buckets(site_id, labels_file)
+    # Compact the journal and clean up orphaned buckets in the background
+    schedule_site_maintenance(site_id, labels_file)
 
     bucket = bucket_manager.get_bucket_for_session(session_id, site_id, labels_file)
 
@@ -418,20 +675,10 @@ def get_bucket():
         return jsonify(
             {"success": False, "message": "No buckets available or all completed"}
         ), 200
+    remember_session_bucket(site_id, session_id, bucket)
 
     # Get labels for bucket images
-    labels = {}
-    if os.path.exists(labels_file):
-        try:
-            all_labels = safe_read_json(labels_file)
-            for img in bucket["images"]:
-                label_data = all_labels.get(img)
-                if label_data:
-                    labels[img] = get_label_value(label_data) or ""
-                else:
-                    labels[img] = ""
-        except:
-            pass
+    labels = get_bucket_labels(bucket, read_labels(labels_file))
 
     return jsonify(
         {
@@ -456,74 +703,74 @@ def save():
     site_id = request.form.get("site")
     if not site_id:
         return jsonify({"success": False, "message": "Site parameter required"}), 400
+    if not is_valid_site_id(site_id):
+        return jsonify({"success": False, "message": "Invalid site"}), 400
+    if site_id not in get_cached_sites(BASE_DIR):
+        return jsonify({"success": False, "message": "Unknown site"}), 404
 
-    # Check if client sent session_id from localStorage
+    # Fall back to the session_id the client kept in localStorage
     client_session_id = request.form.get("session_id") or request.headers.get(
         "X-Session-ID"
     )
-
-    session_id = session.get("session_id")
+    session_id = resolve_session_id(client_session_id, create=False)
     if not session_id:
-        # Try to use client-provided session_id if valid
-        if client_session_id and len(client_session_id) == 32:  # hex string length
-            session_id = client_session_id
-            session["session_id"] = session_id
-        else:
-            return jsonify({"success": False, "message": "No session"}), 400
+        return jsonify({"success": False, "message": "No session"}), 400
 
     # Get site paths
     paths = get_site_paths(BASE_DIR, site_id)
-    labels_file = paths["labels"]
-
-    # Ensure labels file exists
-    if not os.path.exists(labels_file):
-        os.makedirs(os.path.dirname(labels_file), exist_ok=True)
-        with open(labels_file, "w") as fp:
-            json.dump({}, fp)
-
-    # Get labels from request (excluding special fields)
-    labels = dict(request.form)
-    labels.pop("site", None)
-    labels.pop("session_id", None)
-
-    # Handle null values - convert empty strings to null marker
-    # Also convert to nested format with labeled_by
-    processed_labels = {}
-    NULL_MARKER = "__NULL__"
+    labels_file = paths.labels
+
+    # Get labels from request (excluding special fields), converting empty
+    # strings to the null marker
+    label_values = {
+        key: stripped if (stripped := value.strip()) else NULL_MARKER
+        for key, value in request.form.items()
+        if key not in SAVE_CONTROL_FIELDS
+    }
     username = session.get("username")
 
-    # Read existing labels to preserve structure
-    existing_labels = safe_read_json(labels_file)
-
-    for key, value in labels.items():
-        if value.strip() == "":
-            label_value = NULL_MARKER
-        else:
-            label_value = value.strip()
-
-        # Get existing label data to preserve admin_review if present
-        existing_data = existing_labels.get(key)
-        admin_review = None
-        if isinstance(existing_data, dict):
-            admin_review = existing_data.get("admin_review")
-
-        # Create nested structure with labeled_by
-        processed_labels[key] = normalize_label_entry(
-            key, label_value, admin_review=admin_review, labeled_by=username
-        )
+    def apply_labels(all_labels):
+        """Convert to nested format with labeled_by, preserving admin_review."""
+        for key, label_value in label_values.items():
+            # Get existing label data to preserve admin_review if present.
+            # username is always set here (login_required), so the entry is
+            # always written in the nested format.
+            existing_data = all_labels.get(key)
+            admin_review = (
+                existing_data.get("admin_review")
+                if type(existing_data) is dict
+                else None
+            )
+            if admin_review:
+                all_labels[key] = {
+                    "value": label_value,
+                    "labeled_by": username,
+                    "admin_review": admin_review,
+                }
+            else:
+                all_labels[key] = {"value": label_value, "labeled_by": username}
 
-    # Merge labels safely with file locking
+    # Read-modify-write under a single file lock so concurrent admin reviews
+    # are not lost
     try:
-        safe_merge_json(labels_file, processed_labels)
-
-        # Check if current bucket is completed
-        bucket = bucket_manager.get_bucket_for_session(session_id, site_id, labels_file)
-        if bucket:
-            # Check completion
-            all_labels = safe_read_json(labels_file)
-            bucket_completed = all(
-                is_labeled(all_labels.get(img)) for img in bucket["images"]
+        all_labels = update_labels(labels_file, apply_labels, label_values.keys())
+        # Get the edit into labels.json within CLEANUP_INTERVAL, even if idle
+        schedule_site_maintenance(site_id, labels_file)
+
+        # Check if current bucket is completed, using the bucket this session
+        # was served when known
+        images = _session_buckets.get((site_id, session_id))
+        if images is None:
+            bucket = bucket_manager.get_bucket_for_session(
+                session_id, site_id, labels_file, labels=all_labels
             )
+            images = bucket["images"] if bucket else None
+        if images is not None:
+            # Check completion against the labeled set kept with the labels cache
+            bucket_completed = get_labeled_keys(labels_file).issuperset(images)
+            if bucket_completed:
+                # Record it now so progress counts the bucket as completed
+                bucket_manager.complete_bucket(session_id, site_id, labels_file)
 
             return jsonify(
                 {
@@ -543,6 +790,8 @@ def save():
 def get_progress():
     """Get labeling progress."""
     site_id = request.args.get("site")  # Optional - if None, returns global progress
+    if site_id and not is_valid_site_id(site_id):
+        return jsonify({"success": False, "message": "Invalid site"}), 400
     try:
         progress = bucket_manager.get_progress(site_id, None)
         return jsonify({"success": True, "progress": progress})
@@ -575,72 +824,58 @@ def get_admin_images():
         per_page = int(request.args.get("per_page", 50))
         site_id = request.args.get("site")  # Optional filter by site
         hide_reviewed = request.args.get("hide_reviewed", "false").lower() == "true"
+        # Optional comma-separated list of entry fields to return (default: all)
+        fields = request.args.get("fields")
+        if fields:
+            fields = set(fields.split(",")).intersection(ADMIN_IMAGE_FIELDS)
+            if not fields:
+                return jsonify(
+                    {
+                        "success": False,
+                        "message": "No valid fields requested; valid fields: "
+                        + ", ".join(ADMIN_IMAGE_FIELDS),
+                    }
+                ), 400
+        if site_id and not is_valid_site_id(site_id):
+            return jsonify({"success": False, "message": "Invalid site"}), 400
 
-        labeled_images = []
+        sites = [site_id] if site_id else get_cached_sites(BASE_DIR)
+        labels_files = [get_site_paths(BASE_DIR, site).labels for site in sites]
 
-        if site_id:
-            # Single site
-            paths = get_site_paths(BASE_DIR, site_id)
-            labels_file = paths["labels"]
-
-            if os.path.exists(labels_file):
-                all_labels = safe_read_json(labels_file)
-                for filename, label_data in all_labels.items():
-                    value = get_label_value(label_data)
-                    admin_review = get_admin_review(label_data)
-                    labeled_by = None
-                    if isinstance(label_data, dict):
-                        labeled_by = label_data.get("labeled_by")
-                    labeled_images.append(
-                        {
-                            "site": site_id,
-                            "filename": filename,
-                            "value": value or "",
-                            "labeled_by": labeled_by,
-                            "admin_review": admin_review,
-                        }
-                    )
+        # Load every site's labels concurrently so slow reads overlap; reviewed
+        # items are filtered out by the cached per-site list if requested
+        read_args = (labels_files, repeat(hide_reviewed, len(labels_files)))
+        if len(labels_files) > 1:
+            all_site_labels = _labels_read_pool.map(read_sorted_labels, *read_args)
         else:
-            # All sites
-            sites = get_sites(BASE_DIR)
-            for site in sites:
-                paths = get_site_paths(BASE_DIR, site)
-                labels_file = paths["labels"]
-
-                if os.path.exists(labels_file):
-                    all_labels = safe_read_json(labels_file)
-                    for filename, label_data in all_labels.items():
-                        value = get_label_value(label_data)
-                        admin_review = get_admin_review(label_data)
-                        labeled_by = None
-                        if isinstance(label_data, dict):
-                            labeled_by = label_data.get("labeled_by")
-                        labeled_images.append(
-                            {
-                                "site": site,
-                                "filename": filename,
-                                "value": value or "",
-                                "labeled_by": labeled_by,
-                                "admin_review": admin_review,
-                            }
-                        )
-
-        # Filter out reviewed items if requested
-        if hide_reviewed:
-            labeled_images = [
-                img for img in labeled_images
-                if not img.get("admin_review") or not img["admin_review"].get("status")
-            ]
+            all_site_labels = map(read_sorted_labels, *read_args)
 
-        # Sort by site, then filename
-        labeled_images.sort(key=lambda x: (x["site"], x["filename"]))
+        site_labels = {}
+        site_keys = []
+        for site, (all_labels, filenames) in zip(sites, all_site_labels):
+            site_labels[site] = all_labels
+            site_keys.append((site, filenames))
 
-        # Paginate
-        total = len(labeled_images)
+        # Sites are sorted and each site's filenames are sorted, so chaining
+        # them yields (site, filename) order without a global sort
+        total = sum(len(filenames) for _, filenames in site_keys)
         total_pages = (total + per_page - 1) // per_page
         start_idx = (page - 1) * per_page
         end_idx = start_idx + per_page
-        paginated_images = labeled_images[start_idx:end_idx]
+        rows = chain.from_iterable(
+            zip(repeat(site), filenames) for site, filenames in site_keys
+        )
+
+        # Paginate: only the requested page is turned into entry dicts
+        paginated_images = [
+            build_admin_entry(site, filename, site_labels[site].get(filename))
+            for site, filename in islice(rows, max(start_idx, 0), max(end_idx, 0))
+        ]
+        if fields:
+            paginated_images = [
+                {k: v for k, v in entry.items() if k in fields}
+                for entry in paginated_images
+            ]
 
         return jsonify(
             {
@@ -673,99 +908,37 @@ def save_admin_review():
                 return jsonify(
                     {"success": False, "message": "Site required for each review"}
                 ), 400
+            if not is_valid_site_id(site_id):
+                return jsonify({"success": False, "message": "Invalid site"}), 400
+            if site_id not in get_cached_sites(BASE_DIR):
+                return jsonify(
+                    {"success": False, "message": f"Unknown site: {site_id}"}
+                ), 404
 
             if site_id not in reviews_by_site:
                 reviews_by_site[site_id] = []
             reviews_by_site[site_id].append(review)
 
+        # Get reviewer username
+        reviewer_username = session.get("username")
+
         # Process each site's reviews
         for site_id, reviews in reviews_by_site.items():
             paths = get_site_paths(BASE_DIR, site_id)
-            labels_file = paths["labels"]
-
-            # Ensure labels file exists
-            if not os.path.exists(labels_file):
-                os.makedirs(os.path.dirname(labels_file), exist_ok=True)
-                with open(labels_file, "w") as fp:
-                    json.dump({}, fp)
-
-            # Read existing labels
-            all_labels = safe_read_json(labels_file)
-
-            # Process each review
-            for review in reviews:
-                filename = review.get("filename")
-                value = review.get("value")
-                status = review.get("status")  # 'sure' or 'not_sure'
-
-                if not filename:
-                    continue
-
-                # Get current label data
-                current_data = all_labels.get(filename)
-
-                # Determine new value (use provided value or keep existing)
-                old_value = get_label_value(current_data) if current_data else None
-                if value is not None:
-                    new_value = value.strip() if value.strip() else "__NULL__"
-                else:
-                    # Keep existing value
-                    new_value = old_value if old_value else "__NULL__"
-
-                # Get reviewer username
-                reviewer_username = session.get("username")
-
-                # Check if admin changed the value
-                value_changed = (value is not None and new_value != old_value)
-                
-                # If admin changed the value, update labeled_by to admin name
-                if value_changed:
-                    labeled_by = reviewer_username
-                else:
-                    # Get labeled_by from existing data if present
-                    if isinstance(current_data, dict):
-                        labeled_by = current_data.get("labeled_by")
-                    elif current_data:
-                        # If it's flat, we don't know who labeled it
-                        labeled_by = None
-                    else:
-                        labeled_by = None
-
-                # Create admin review structure with reviewed_by
-                admin_review = None
-                if status:
-                    admin_review = {"status": status, "reviewed_by": reviewer_username}
-
-                # Update label entry - always use nested structure if admin_review exists
-                if admin_review:
-                    # Use nested structure with admin_review
-                    entry = {"value": new_value, "admin_review": admin_review}
-                    if labeled_by:
-                        entry["labeled_by"] = labeled_by
-                    all_labels[filename] = entry
-                else:
-                    # If no admin review but value changed, preserve structure
-                    if isinstance(current_data, dict):
-                        # Preserve existing structure
-                        entry = {"value": new_value}
-                        if labeled_by:
-                            entry["labeled_by"] = labeled_by
-                        if current_data.get("admin_review"):
-                            entry["admin_review"] = current_data.get("admin_review")
-                        all_labels[filename] = entry
-                    else:
-                        # Convert flat to nested if we have labeled_by info
-                        # Otherwise keep flat for backward compatibility
-                        if labeled_by:
-                            all_labels[filename] = {
-                                "value": new_value,
-                                "labeled_by": labeled_by,
-                            }
-                        else:
-                            all_labels[filename] = new_value
-
-            # Write back
-            safe_write_json(labels_file, all_labels)
+            labels_file = paths.labels
+
+            def apply_reviews(all_labels, reviews=reviews):
+                for review in reviews:
+                    apply_admin_review(all_labels, review, reviewer_username)
+
+            # Apply the reviews under the file lock so concurrent label saves
+            # are not lost between the read and the write
+            update_labels(
+                labels_file,
+                apply_reviews,
+                [review["filename"] for review in reviews if review.get("filename")],
+            )
+            schedule_site_maintenance(site_id, labels_file)
 
         return jsonify({"success": True, "message": "Review saved successfully"})
     except Exception as e:
@@ -802,22 +975,22 @@ def create_or_update_user():
         if not username:
             return jsonify({"success": False, "message": "Username required"}), 400
 
-        users = load_users()
+        users, index = load_users_with_index()
 
         # Check if user exists
-        user_index = None
-        for i, u in enumerate(users):
-            if u.get("username") == username:
-                user_index = i
-                break
+        user_index = index.get(username)
 
         # Update or create user
         user_data = {"username": username, "is_admin": bool(is_admin)}
         if password:
-            user_data["password"] = password
+            user_data["password_hash"] = hash_password(password)
         elif user_index is not None:
-            # Keep existing password if not provided
-            user_data["password"] = users[user_index].get("password", "")
+            # Keep existing password if not provided (hash, or legacy plain text)
+            existing = users[user_index]
+            if "password_hash" in existing:
+                user_data["password_hash"] = existing["password_hash"]
+            else:
+                user_data["password"] = existing.get("password", "")
 
         if user_index is not None:
             users[user_index] = user_data
@@ -3,24 +3,43 @@ Authentication utilities for user management.
 """
 
 import os
-import json
+import hmac
 from functools import wraps
 from flask import session, jsonify, redirect, url_for, request
-from file_lock import safe_write_json
+from werkzeug.security import check_password_hash, generate_password_hash
+from file_lock import (
+    FileLock,
+    file_signature,
+    load_json_file,
+    safe_write_json,
+    write_json_unlocked,
+)
+
+
+# RESULTS_BASE_DIR value -> users.json path (storage directory already created)
+_users_file_paths = {}
 
 
 def get_users_file_path():
     """
     Get the path to users.json file in the storage directory.
-    Uses the same BASE_DIR logic as app.py
+    Uses the same BASE_DIR logic as app.py. The path is resolved and the
+    directory created once per base directory setting.
     """
-    base_dir = os.environ.get(
-        "RESULTS_BASE_DIR", os.path.join(os.path.dirname(__file__), "..", "storage")
-    )
-    base_dir = os.path.abspath(base_dir)
-    users_file = os.path.join(base_dir, "users.json")
+    base_dir = os.environ.get("RESULTS_BASE_DIR")
+    users_file = _users_file_paths.get(base_dir)
+    if users_file is not None:
+        return users_file
+
+    if base_dir is None:
+        storage_dir = os.path.join(os.path.dirname(__file__), "..", "storage")
+    else:
+        storage_dir = base_dir
+    storage_dir = os.path.abspath(storage_dir)
+    users_file = os.path.join(storage_dir, "users.json")
     # Ensure storage directory exists
-    os.makedirs(base_dir, exist_ok=True)
+    os.makedirs(storage_dir, exist_ok=True)
+    _users_file_paths[base_dir] = users_file
     return users_file
 
 
@@ -28,29 +47,28 @@ def get_users_file_path():
 USERS_FILE = get_users_file_path()
 
 
-def load_users():
+# Parsed users.json: ((mtime_ns, size), users list, username -> index)
+_users_cache = None
+
+
+def _read_users_file(users_file):
     """
-    Load users from users.json file.
+    Read and parse users.json.
+
+    Args:
+        users_file: Path to users.json
 
     Returns:
-        List of user dictionaries (empty list if file doesn't exist or is empty)
+        List of user dictionaries (empty list if file is empty or invalid)
     """
-    # Update USERS_FILE path in case BASE_DIR changed
-    global USERS_FILE
-    USERS_FILE = get_users_file_path()
-    
-    if not os.path.exists(USERS_FILE):
-        return []
-
     try:
         # Check if file is empty
-        if os.path.getsize(USERS_FILE) == 0:
+        if os.path.getsize(users_file) == 0:
             return []
-        
+
         # Read users.json directly (it's a list, not a dict)
-        # User changes are infrequent, so simple file read is fine
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            users_data = json.load(f)
+        with open(users_file, "rb") as f:
+            users_data = load_json_file(f)
             # Handle both list and dict formats
             if isinstance(users_data, list):
                 return users_data if len(users_data) > 0 else []
@@ -59,17 +77,78 @@ def load_users():
                 return list(users_data.values()) if len(users_data) > 0 else []
             else:
                 return []
-    except json.JSONDecodeError:
+    except ValueError:  # includes JSONDecodeError
         # File exists but is invalid JSON - treat as empty
         return []
     except Exception as e:
         # Log error for debugging
         import logging
 
-        logging.error(f"Error loading users from {USERS_FILE}: {e}")
+        logging.error(f"Error loading users from {users_file}: {e}")
         return []
 
 
+def _cache_users(signature, users):
+    """
+    Store parsed users along with a username -> index lookup.
+
+    Args:
+        signature: File signature the users were read at
+        users: List of user dictionaries
+
+    Returns:
+        The cache entry
+    """
+    global _users_cache
+    index = {}
+    for i, user in enumerate(users):
+        # First entry wins, matching the old linear scan
+        index.setdefault(user.get("username"), i)
+    _users_cache = (signature, users, index)
+    return _users_cache
+
+
+def _get_users_cache():
+    """
+    Get the cached users, re-reading users.json only if it changed.
+
+    Returns:
+        Tuple of (signature, users list, username -> index dict)
+    """
+    # Update USERS_FILE path in case BASE_DIR changed
+    global USERS_FILE
+    USERS_FILE = get_users_file_path()
+
+    signature = file_signature(USERS_FILE)
+    if signature is None:
+        return (None, [], {})
+    if _users_cache is not None and _users_cache[0] == signature:
+        return _users_cache
+    return _cache_users(signature, _read_users_file(USERS_FILE))
+
+
+def load_users():
+    """
+    Load users from users.json file.
+
+    Returns:
+        List of user dictionaries (empty list if file doesn't exist or is empty)
+    """
+    # Copy the list so callers can add/remove users without touching the cache
+    return list(_get_users_cache()[1])
+
+
+def load_users_with_index():
+    """
+    Load users together with a username -> list index lookup.
+
+    Returns:
+        Tuple of (list of user dictionaries, dict mapping username to index)
+    """
+    _, users, index = _get_users_cache()
+    return list(users), index
+
+
 def save_users(users):
     """
     Save users to users.json file.
@@ -80,7 +159,9 @@ def save_users(users):
     # Update USERS_FILE path in case BASE_DIR changed
     global USERS_FILE
     USERS_FILE = get_users_file_path()
+    users = list(users)
     safe_write_json(USERS_FILE, users)
+    _cache_users(file_signature(USERS_FILE), users)
 
 
 def get_user(username):
@@ -93,16 +174,65 @@ def get_user(username):
     Returns:
         User dict or None if not found
     """
-    users = load_users()
-    for user in users:
-        if user.get("username") == username:
-            return user
-    return None
+    _, users, index = _get_users_cache()
+    i = index.get(username)
+    if i is None:
+        return None
+    return users[i]
+
+
+def hash_password(password):
+    """
+    Hash a password for storage in users.json.
+
+    Args:
+        password: Password (plain text)
+
+    Returns:
+        Salted password hash string
+    """
+    return generate_password_hash(password)
+
+
+def _upgrade_legacy_password(username, password):
+    """
+    Replace a user's plain text password with a hash.
+
+    Args:
+        username: Username whose stored password matched
+        password: The verified password (plain text)
+    """
+    password_hash = hash_password(password)
+    users_file = get_users_file_path()
+    # Read-modify-write under the file lock so a concurrent save isn't lost
+    with FileLock(users_file):
+        users = _read_users_file(users_file)
+        for i, user in enumerate(users):
+            if user.get("username") == username:
+                break
+        else:
+            return
+        # Skip if the password was changed or already upgraded meanwhile
+        stored = user.get("password")
+        if (
+            "password_hash" in user
+            or not isinstance(stored, str)
+            or not hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+        ):
+            return
+        user = dict(user)
+        user.pop("password", None)
+        user["password_hash"] = password_hash
+        users[i] = user
+        write_json_unlocked(users_file, users)
+        _cache_users(file_signature(users_file), users)
 
 
 def validate_user(username, password):
     """
     Validate username and password.
+    Accounts still stored with a plain text password are upgraded to a hash
+    on their first successful login.
 
     Args:
         username: Username
@@ -112,9 +242,25 @@ def validate_user(username, password):
         User dict if valid, None otherwise
     """
     user = get_user(username)
-    if user and user.get("password") == password:
-        return user
-    return None
+    if not user:
+        return None
+
+    password_hash = user.get("password_hash")
+    if password_hash:
+        return user if check_password_hash(password_hash, password) else None
+
+    stored = user.get("password")
+    if stored is None or not hmac.compare_digest(
+        stored.encode("utf-8"), password.encode("utf-8")
+    ):
+        return None
+    try:
+        _upgrade_legacy_password(username, password)
+    except Exception as e:
+        import logging
+
+        logging.error(f"Error upgrading password for {username}: {e}")
+    return user
 
 
 def login_required(f):
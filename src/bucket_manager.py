@@ -3,29 +3,116 @@ Bucket management system for distributing images across multiple users.
 """
 
 import os
-import json
+import heapq
 import threading
-from file_lock import safe_read_json, safe_write_json
-from sites import get_site_paths, get_sites
+from bisect import insort
+from file_lock import file_signature, safe_read_json, safe_write_json
+from sites import get_cached_sites, get_site_paths
+from label_store import get_labeled_keys, is_labeled, read_labels
 
+# Lowercased file extensions treated as captcha images
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
 
-def is_labeled(label_data):
+
+def _index_buckets(data, images_saved=True):
+    """
+    Build lookup indexes over bucket data in one pass.
+
+    Args:
+        data: Bucket dictionary (buckets.json with each bucket's images)
+        images_saved: Whether bucket_images.json already holds these buckets'
+            image lists
+
+    Returns:
+        Bucket state dictionary with keys:
+            data: the bucket dictionary itself
+            images_saved: the images_saved argument
+            by_session: session_id -> sorted indexes of its assigned buckets
+            unassigned: heap of unassigned bucket indexes (may hold stale
+                entries, skipped by _next_unassigned)
+            assigned: set of assigned bucket indexes
+            completed: number of completed buckets
+            total_images: number of images across all buckets
     """
-    Check if image is labeled (handles both flat and nested formats).
+    by_session = {}
+    unassigned = []
+    assigned = set()
+    completed = 0
+    total_images = 0
+    for index, bucket in enumerate(data.get("buckets", ())):
+        total_images += len(bucket["images"])
+        status = bucket["status"]
+        if status == "unassigned":
+            unassigned.append(index)  # ascending, so already a valid heap
+        elif status == "assigned":
+            assigned.add(index)
+            by_session.setdefault(bucket["assigned_to"], []).append(index)
+        elif status == "completed":
+            completed += 1
+    return {
+        "data": data,
+        "images_saved": images_saved,
+        "by_session": by_session,
+        "unassigned": unassigned,
+        "assigned": assigned,
+        "completed": completed,
+        "total_images": total_images,
+    }
+
+
+def _set_bucket_state(state, index, status, assigned_to):
+    """
+    Change a bucket's status and owner, keeping the state indexes in step.
+
+    Args:
+        state: Bucket state dictionary
+        index: Position of the bucket in the buckets list
+        status: New status ("unassigned", "assigned" or "completed")
+        assigned_to: Session id owning the bucket, or None
+    """
+    bucket = state["data"]["buckets"][index]
+    old_status = bucket["status"]
+    if old_status == "assigned":
+        state["assigned"].discard(index)
+        owned = state["by_session"].get(bucket["assigned_to"])
+        if owned is not None:
+            if index in owned:
+                owned.remove(index)
+            if not owned:
+                del state["by_session"][bucket["assigned_to"]]
+    elif old_status == "completed":
+        state["completed"] -= 1
+
+    bucket["status"] = status
+    bucket["assigned_to"] = assigned_to
+
+    if status == "assigned":
+        state["assigned"].add(index)
+        insort(state["by_session"].setdefault(assigned_to, []), index)
+    elif status == "unassigned":
+        heapq.heappush(state["unassigned"], index)
+    elif status == "completed":
+        state["completed"] += 1
+
+
+def _next_unassigned(state):
+    """
+    Get the lowest-index unassigned bucket, dropping stale heap entries.
 
     Args:
-        label_data: Either a string (old format) or dict (new format)
+        state: Bucket state dictionary
 
     Returns:
-        True if labeled, False otherwise
+        Bucket index, or None if every bucket is assigned or completed
     """
-    if label_data is None:
-        return False
-    if isinstance(label_data, str):
-        return True  # Any string value means labeled (including "__NULL__")
-    if isinstance(label_data, dict):
-        return "value" in label_data
-    return False
+    heap = state["unassigned"]
+    buckets = state["data"]["buckets"]
+    while heap:
+        index = heap[0]
+        if buckets[index]["status"] == "unassigned":
+            return index
+        heapq.heappop(heap)
+    return None
 
 
 class BucketManager:
@@ -41,51 +128,190 @@ class BucketManager:
         """
         self.base_dir = base_dir
         self.bucket_size = bucket_size
-        self.lock = threading.Lock()
+        # site_id -> threading.Lock; sites never block each other
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        # site_id -> (img dir mtime_ns, sorted image filenames)
+        self._images_cache = {}
+        # site_id -> ((mtime_ns, size) of buckets.json, indexed bucket state)
+        self._buckets_cache = {}
+        # site_id -> ((mtime_ns, size) of bucket_images.json, image lists)
+        self._bucket_images_cache = {}
+
+    def _lock_for(self, site_id):
+        """
+        Get the lock guarding a site's buckets, creating it on first use.
+
+        Args:
+            site_id: Site identifier
+
+        Returns:
+            threading.Lock for the site
+        """
+        lock = self._locks.get(site_id)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(site_id, threading.Lock())
+        return lock
 
     def _get_all_images(self, site_id):
         """
         Get list of all image files for a site.
+        The listing is reused until the image directory's mtime changes,
+        which happens whenever files are added, removed or renamed.
 
         Args:
             site_id: Site identifier
 
         Returns:
-            List of image filenames
+            Sorted list of image filenames (shared, do not mutate)
         """
         paths = get_site_paths(self.base_dir, site_id)
-        img_dir = paths["img"]
-        files = []
-        if os.path.exists(img_dir):
-            for f in os.listdir(img_dir):
-                if os.path.isfile(os.path.join(img_dir, f)):
-                    ext = os.path.splitext(f)[-1].lower()
-                    if ext in [".jpg", ".jpeg", ".png"]:
-                        files.append(f)
-        return sorted(files)
+        img_dir = paths.img
+        try:
+            mtime_ns = os.stat(img_dir).st_mtime_ns
+        except FileNotFoundError:
+            self._images_cache.pop(site_id, None)
+            return []
+        cached = self._images_cache.get(site_id)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
 
-    def _initialize_buckets(self, site_id):
+        try:
+            # DirEntry.is_file() uses the file type from the directory listing,
+            # so regular files don't need a stat() each
+            with os.scandir(img_dir) as entries:
+                files = [
+                    entry.name
+                    for entry in entries
+                    if entry.name.lower().endswith(IMAGE_EXTENSIONS)
+                    and entry.is_file()
+                ]
+        except FileNotFoundError:
+            return []
+        files.sort()
+        self._images_cache[site_id] = (mtime_ns, files)
+        return files
+
+    def _load_buckets(self, site_id):
         """
-        Initialize or load bucket structure for a site.
+        Get a site's bucket state, re-reading buckets.json only if it changed.
+        Caller must hold the site's lock; changes must go through
+        _set_bucket_state and be saved with _save_buckets.
+
+        Args:
+            site_id: Site identifier
+
+        Returns:
+            Bucket state dictionary (see _index_buckets) shared with the cache,
+            or None if buckets.json is missing, invalid or doesn't match
+            bucket_images.json (_initialize_buckets then recreates the buckets)
+        """
+        buckets_file = get_site_paths(self.base_dir, site_id).buckets
+        signature = file_signature(buckets_file)
+        if signature is None:
+            self._buckets_cache.pop(site_id, None)
+            return None
+        cached = self._buckets_cache.get(site_id)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        data = safe_read_json(buckets_file)
+        buckets = data.get("buckets")
+        if not isinstance(buckets, list) or "bucket_size" not in data:
+            self._buckets_cache.pop(site_id, None)
+            return None
+        if all("images" in b for b in buckets):
+            # Older single-file format with the image lists inline; they
+            # move to bucket_images.json on the next save
+            state = _index_buckets(data, images_saved=False)
+        else:
+            images = self._load_bucket_images(site_id)
+            if images is None or len(images) != len(buckets):
+                # Incomplete bucket files: treat as missing so they get recreated
+                self._buckets_cache.pop(site_id, None)
+                return None
+            for bucket, bucket_images in zip(buckets, images):
+                bucket["images"] = bucket_images
+            state = _index_buckets(data)
+        self._buckets_cache[site_id] = (signature, state)
+        return state
+
+    def _load_bucket_images(self, site_id):
+        """
+        Get each bucket's image list from bucket_images.json. The file is only
+        written when buckets are recreated, so it is parsed once and cached.
 
         Args:
             site_id: Site identifier
+
+        Returns:
+            List of image filename lists (one per bucket), or None if the
+            file is missing or invalid
+        """
+        images_file = get_site_paths(self.base_dir, site_id).bucket_images
+        signature = file_signature(images_file)
+        if signature is None:
+            self._bucket_images_cache.pop(site_id, None)
+            return None
+        cached = self._bucket_images_cache.get(site_id)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        images = safe_read_json(images_file).get("buckets")
+        if not isinstance(images, list):
+            return None
+        self._bucket_images_cache[site_id] = (signature, images)
+        return images
+
+    def _save_buckets(self, site_id, state):
+        """
+        Write a site's bucket data and keep it cached. Caller must hold the
+        site's lock.
+        Only assignments and statuses go to buckets.json; image lists never
+        change after the buckets are created, so bucket_images.json is only
+        written the first time.
+
+        Args:
+            site_id: Site identifier
+            state: Bucket state dictionary
         """
         paths = get_site_paths(self.base_dir, site_id)
-        buckets_file = paths["buckets"]
+        data = state["data"]
+        try:
+            if not state["images_saved"]:
+                images = [bucket["images"] for bucket in data["buckets"]]
+                safe_write_json(paths.bucket_images, {"buckets": images})
+                self._bucket_images_cache[site_id] = (
+                    file_signature(paths.bucket_images),
+                    images,
+                )
+                state["images_saved"] = True
+            buckets = [
+                {key: value for key, value in bucket.items() if key != "images"}
+                for bucket in data["buckets"]
+            ]
+            safe_write_json(paths.buckets, {**data, "buckets": buckets})
+        except Exception:
+            # The cached state may hold changes that never reached the file
+            self._buckets_cache.pop(site_id, None)
+            raise
+        self._buckets_cache[site_id] = (file_signature(paths.buckets), state)
 
-        with self.lock:
-            if os.path.exists(buckets_file):
-                try:
-                    data = safe_read_json(buckets_file)
-                    # Validate structure
-                    if "buckets" in data and "bucket_size" in data:
-                        # Update bucket_size if changed
-                        if data["bucket_size"] != self.bucket_size:
-                            self._recreate_buckets(site_id)
-                        return
-                except (json.JSONDecodeError, KeyError):
-                    pass
+    def _initialize_buckets(self, site_id):
+        """
+        Initialize or load bucket structure for a site.
+
+        Args:
+            site_id: Site identifier
+        """
+        with self._lock_for(site_id):
+            # Missing, unreadable or mismatched bucket files load as None
+            state = self._load_buckets(site_id)
+            if state is not None:
+                # Update bucket_size if changed
+                if state["data"]["bucket_size"] != self.bucket_size:
+                    self._recreate_buckets(site_id)
+                return
 
             # Create new bucket structure
             self._recreate_buckets(site_id)
@@ -97,8 +323,6 @@ class BucketManager:
         Args:
             site_id: Site identifier
         """
-        paths = get_site_paths(self.base_dir, site_id)
-        buckets_file = paths["buckets"]
         images = self._get_all_images(site_id)
         buckets = []
 
@@ -115,7 +339,7 @@ class BucketManager:
 
         data = {"buckets": buckets, "bucket_size": self.bucket_size}
 
-        safe_write_json(buckets_file, data)
+        self._save_buckets(site_id, _index_buckets(data, images_saved=False))
 
     def validate_and_cleanup_buckets(self, site_id, labels_file):
         """
@@ -126,32 +350,27 @@ class BucketManager:
             site_id: Site identifier
             labels_file: Path to labels.json to check completion
         """
-        paths = get_site_paths(self.base_dir, site_id)
-        buckets_file = paths["buckets"]
-
-        with self.lock:
-            if not os.path.exists(buckets_file):
+        with self._lock_for(site_id):
+            state = self._load_buckets(site_id)
+            if state is None:
                 return
 
-            data = safe_read_json(buckets_file)
-            buckets = data["buckets"]
+            buckets = state["data"]["buckets"]
             changed = False
 
-            for bucket in buckets:
-                if bucket["status"] == "assigned":
-                    # Check if bucket is actually completed
-                    if self._is_bucket_completed(bucket, labels_file):
-                        bucket["status"] = "completed"
-                        bucket["assigned_to"] = None
-                        changed = True
-                    # Note: We don't release incomplete buckets here automatically
-                    # as they might be actively worked on. They'll be reassigned
-                    # in get_bucket_for_session if needed.
+            for index in sorted(state["assigned"]):
+                # Check if bucket is actually completed
+                if self._is_bucket_completed(buckets[index], labels_file):
+                    _set_bucket_state(state, index, "completed", None)
+                    changed = True
+                # Note: We don't release incomplete buckets here automatically
+                # as they might be actively worked on. They'll be reassigned
+                # in get_bucket_for_session if needed.
 
             if changed:
-                safe_write_json(buckets_file, data)
+                self._save_buckets(site_id, state)
 
-    def get_bucket_for_session(self, session_id, site_id, labels_file):
+    def get_bucket_for_session(self, session_id, site_id, labels_file, labels=None):
         """
         Get or assign a bucket for a session for a specific site.
 
@@ -159,80 +378,111 @@ class BucketManager:
             session_id: Unique session identifier
             site_id: Site identifier
             labels_file: Path to labels.json to check completion
+            labels: Optional already-loaded labels dict to check completion
+                against instead of reading labels_file
 
         Returns:
             Dictionary with bucket info or None if no buckets available
         """
-        paths = get_site_paths(self.base_dir, site_id)
-        buckets_file = paths["buckets"]
-
         # Ensure buckets are initialized
         self._initialize_buckets(site_id)
 
-        with self.lock:
-            data = safe_read_json(buckets_file)
-            buckets = data["buckets"]
+        with self._lock_for(site_id):
+            state = self._load_buckets(site_id)
+            if state is None:
+                # Bucket files vanished or broke since they were initialized
+                return None
+            buckets = state["data"]["buckets"]
+
+            # Bucket changes are written once, after the bucket is chosen
+            changed = False
+            bucket = None
 
             # Check if session already has an assigned bucket
-            for bucket in buckets:
-                if (
-                    bucket["assigned_to"] == session_id
-                    and bucket["status"] == "assigned"
-                ):
-                    # Check if bucket is completed
-                    if self._is_bucket_completed(bucket, labels_file):
-                        bucket["status"] = "completed"
-                        bucket["assigned_to"] = None
-                        safe_write_json(buckets_file, data)
-                    else:
-                        return bucket
-
-            # Find next unassigned bucket
-            for bucket in buckets:
-                if bucket["status"] == "unassigned":
-                    bucket["assigned_to"] = session_id
-                    bucket["status"] = "assigned"
-                    safe_write_json(buckets_file, data)
-                    return bucket
-
-            # Check for incomplete assigned buckets (in case user disconnected)
-            # Find buckets that are assigned but not completed
-            for bucket in buckets:
-                if bucket["status"] == "assigned":
-                    if not self._is_bucket_completed(bucket, labels_file):
+            for index in list(state["by_session"].get(session_id, ())):
+                # Check if bucket is completed
+                if self._is_bucket_completed(buckets[index], labels_file, labels):
+                    _set_bucket_state(state, index, "completed", None)
+                    changed = True
+                else:
+                    bucket = buckets[index]
+                    break
+
+            if bucket is None:
+                # Find next unassigned bucket
+                index = _next_unassigned(state)
+                if index is not None:
+                    _set_bucket_state(state, index, "assigned", session_id)
+                    changed = True
+                    bucket = buckets[index]
+
+            if bucket is None:
+                # Check for incomplete assigned buckets (in case user disconnected)
+                # Find buckets that are assigned but not completed
+                for index in sorted(state["assigned"]):
+                    if not self._is_bucket_completed(
+                        buckets[index], labels_file, labels
+                    ):
                         # Reassign to new session (orphaned bucket)
-                        bucket["assigned_to"] = session_id
-                        safe_write_json(buckets_file, data)
-                        return bucket
+                        _set_bucket_state(state, index, "assigned", session_id)
+                        changed = True
+                        bucket = buckets[index]
+                        break
 
-            # All buckets completed
-            return None
+            if changed:
+                self._save_buckets(site_id, state)
 
-    def _is_bucket_completed(self, bucket, labels_file):
+            # None if all buckets are completed
+            return bucket
+
+    def _is_bucket_completed(self, bucket, labels_file, labels=None):
         """
         Check if all images in bucket are labeled.
 
         Args:
             bucket: Bucket dictionary
             labels_file: Path to labels.json
+            labels: Optional already-loaded labels dict (skips reading labels_file)
 
         Returns:
             True if all images are labeled
         """
-        if not os.path.exists(labels_file):
-            return False
-
         try:
-            labels = safe_read_json(labels_file)
-            for image in bucket["images"]:
-                # Image is considered labeled if it has a value (including null marker)
-                label_data = labels.get(image)
-                if not is_labeled(label_data):
-                    return False
-            return True
+            # Image is considered labeled if it has a value (including null marker)
+            if labels is not None:
+                return all(is_labeled(labels.get(image)) for image in bucket["images"])
+            # Set lookup against the labeled filenames cached with the labels
+            # (empty if labels_file doesn't exist yet)
+            return get_labeled_keys(labels_file).issuperset(bucket["images"])
         except:
             return False
 
+    def complete_bucket(self, session_id, site_id, labels_file):
+        """
+        Mark a session's fully labeled buckets completed.
+        Called right after a save finishes a bucket, so progress reflects it
+        without waiting for the next bucket request or cleanup.
+
+        Args:
+            session_id: Session identifier
+            site_id: Site identifier
+            labels_file: Path to labels.json to check completion
+        """
+        with self._lock_for(site_id):
+            state = self._load_buckets(site_id)
+            if state is None:
+                return
+
+            buckets = state["data"]["buckets"]
+            changed = False
+            for index in list(state["by_session"].get(session_id, ())):
+                if self._is_bucket_completed(buckets[index], labels_file):
+                    _set_bucket_state(state, index, "completed", None)
+                    changed = True
+
+            if changed:
+                self._save_buckets(site_id, state)
+
     def release_bucket(self, session_id, site_id, labels_file):
         """
         Release bucket assigned to a session (for cleanup).
@@ -242,27 +492,19 @@ class BucketManager:
             site_id: Site identifier
             labels_file: Path to labels.json to check completion
         """
-        paths = get_site_paths(self.base_dir, site_id)
-        buckets_file = paths["buckets"]
-
-        with self.lock:
-            if not os.path.exists(buckets_file):
+        with self._lock_for(site_id):
+            state = self._load_buckets(site_id)
+            if state is None:
                 return
 
-            data = safe_read_json(buckets_file)
-            buckets = data["buckets"]
-
-            for bucket in buckets:
-                if (
-                    bucket["assigned_to"] == session_id
-                    and bucket["status"] == "assigned"
-                ):
-                    # Only release if not completed
-                    if not self._is_bucket_completed(bucket, labels_file):
-                        bucket["assigned_to"] = None
-                        bucket["status"] = "unassigned"
-                        safe_write_json(buckets_file, data)
-                    break
+            owned = state["by_session"].get(session_id)
+            if owned:
+                index = owned[0]
+                # Only release if not completed
+                bucket = state["data"]["buckets"][index]
+                if not self._is_bucket_completed(bucket, labels_file):
+                    _set_bucket_state(state, index, "unassigned", None)
+                    self._save_buckets(site_id, state)
 
     def get_progress(self, site_id, labels_file):
         """
@@ -277,12 +519,11 @@ class BucketManager:
         """
         if site_id:
             # Single site progress
-            paths = get_site_paths(self.base_dir, site_id)
-            buckets_file = paths["buckets"]
-            labels_file = paths["labels"]
+            labels_file = get_site_paths(self.base_dir, site_id).labels
 
-            with self.lock:
-                if not os.path.exists(buckets_file):
+            with self._lock_for(site_id):
+                state = self._load_buckets(site_id)
+                if state is None:
                     return {
                         "total_images": 0,
                         "labeled_images": 0,
@@ -292,29 +533,24 @@ class BucketManager:
                         "progress_percent": 0,
                     }
 
-                data = safe_read_json(buckets_file)
-                buckets = data["buckets"]
-
-                total_images = sum(len(b["images"]) for b in buckets)
+                # Counts are kept with the cached bucket indexes
+                total_images = state["total_images"]
+                total_buckets = len(state["data"].get("buckets", ()))
+                completed_buckets = state["completed"]
+                assigned_buckets = len(state["assigned"])
                 labeled_images = 0
 
-                if os.path.exists(labels_file):
-                    try:
-                        labels = safe_read_json(labels_file)
-                        # Count all images that have labels (including null markers)
-                        labeled_images = len(labels)
-                    except:
-                        pass
-
-                completed_buckets = sum(
-                    1 for b in buckets if b["status"] == "completed"
-                )
-                assigned_buckets = sum(1 for b in buckets if b["status"] == "assigned")
+                try:
+                    # Count all images that have labels (including null markers);
+                    # a missing labels file reads as empty
+                    labeled_images = len(read_labels(labels_file))
+                except:
+                    pass
 
                 return {
                     "total_images": total_images,
                     "labeled_images": labeled_images,
-                    "total_buckets": len(buckets),
+                    "total_buckets": total_buckets,
                     "completed_buckets": completed_buckets,
                     "assigned_buckets": assigned_buckets,
                     "progress_percent": (labeled_images / total_images * 100)
@@ -323,20 +559,23 @@ class BucketManager:
                 }
         else:
             # Global progress across all sites
-            sites = get_sites(self.base_dir)
+            # Reuse the recent site scan the request handlers share
+            site_progress = {
+                site: self.get_progress(site, None)
+                for site in get_cached_sites(self.base_dir)
+            }
             total_images = 0
             labeled_images = 0
             total_buckets = 0
             completed_buckets = 0
             assigned_buckets = 0
 
-            for site in sites:
-                site_progress = self.get_progress(site, None)
-                total_images += site_progress["total_images"]
-                labeled_images += site_progress["labeled_images"]
-                total_buckets += site_progress["total_buckets"]
-                completed_buckets += site_progress["completed_buckets"]
-                assigned_buckets += site_progress["assigned_buckets"]
+            for progress in site_progress.values():
+                total_images += progress["total_images"]
+                labeled_images += progress["labeled_images"]
+                total_buckets += progress["total_buckets"]
+                completed_buckets += progress["completed_buckets"]
+                assigned_buckets += progress["assigned_buckets"]
 
             return {
                 "total_images": total_images,
@@ -347,5 +586,5 @@ class BucketManager:
                 "progress_percent": (labeled_images / total_images * 100)
                 if total_images > 0
                 else 0,
-                "sites": {site: self.get_progress(site, None) for site in sites},
+                "sites": site_progress,
             }
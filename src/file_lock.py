@@ -1,6 +1,8 @@
 """
 File locking utilities for safe concurrent file operations.
-Uses lock files for cross-platform compatibility.
+Uses flock() on a lock file where available (shared locks for readers,
+exclusive for writers) and exclusive lock files elsewhere. Lock files are
+kept in a .locks folder next to the files they protect.
 """
 
 import os
@@ -8,42 +10,199 @@ import json
 import time
 import platform
 import threading
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder/decoder
+    orjson = None
+
+
+def loads_json(raw):
+    """
+    Parse JSON from bytes or str, using orjson when it is installed.
+
+    Args:
+        raw: JSON document as bytes or str
+
+    Returns:
+        Parsed Python object
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def load_json_file(f):
+    """
+    Parse JSON from an open binary file, using orjson when it is installed.
+
+    Args:
+        f: File object opened in binary mode
+
+    Returns:
+        Parsed Python object
+    """
+    return loads_json(f.read())
+
+
+def dumps_json(data, indent=False, default=None):
+    """
+    Serialize data to UTF-8 JSON bytes, using orjson when it is installed.
+
+    Args:
+        data: Object to serialize
+        indent: Pretty-print with two-space indentation
+        default: Optional callable for objects JSON can't represent
+
+    Returns:
+        JSON document as bytes
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=option)
+    return json.dumps(
+        data,
+        indent=2 if indent else None,
+        separators=None if indent else (",", ":"),
+        default=default,
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+
+# filepath -> threading.Lock shared by exclusive FileLocks on that file in this
+# process. Dropped automatically once no FileLock holds a reference.
+_thread_locks = weakref.WeakValueDictionary()
+_thread_locks_guard = threading.Lock()
+
+# Lock files live in this subdirectory of the locked file's directory, so
+# they stay out of the way of the data files
+LOCK_DIR_NAME = ".locks"
+
+# Lock directories already created by this process
+_lock_dirs = set()
+
+# Age (seconds) after which a plain lock file is considered abandoned
+STALE_LOCK_SECONDS = 30
+
+# Attempts at os.replace() on Windows, where it fails with PermissionError
+# while another handle (e.g. an unlocked reader) has the target open
+REPLACE_ATTEMPTS = 5
+
+# First wait between lock attempts (seconds); doubles up to retry_interval
+_MIN_RETRY_INTERVAL = 0.001
+
+
+def _thread_lock_for(filepath):
+    """
+    Get the in-process lock for exclusive FileLocks on a file.
+
+    Args:
+        filepath: Path to the locked file
+
+    Returns:
+        threading.Lock for the file
+    """
+    with _thread_locks_guard:
+        lock = _thread_locks.get(filepath)
+        if lock is None:
+            lock = threading.Lock()
+            _thread_locks[filepath] = lock
+        return lock
 
 
 class FileLock:
     """Context manager for file locking using lock files."""
 
-    def __init__(self, filepath, timeout=10, retry_interval=0.1):
+    def __init__(self, filepath, timeout=10, retry_interval=0.05, shared=False):
         """
         Initialize file lock.
 
         Args:
             filepath: Path to the file to lock
             timeout: Maximum time to wait for lock (seconds)
-            retry_interval: Time between lock attempts (seconds)
+            retry_interval: Longest wait between lock attempts (seconds); waits
+                start at 1ms and double up to this
+            shared: Take a shared (reader) lock instead of an exclusive one.
+                Only honoured where flock() is available; otherwise the lock
+                is exclusive.
         """
         self.filepath = filepath
-        self.lock_filepath = filepath + ".lock"
+        directory, name = os.path.split(filepath)
+        self.lock_dir = os.path.join(directory, LOCK_DIR_NAME)
+        self.lock_filepath = os.path.join(self.lock_dir, name + ".lock")
         self.timeout = timeout
         self.retry_interval = retry_interval
+        self.shared = shared
         self.lock_file_handle = None
-        self._local_lock = threading.Lock()  # Thread-local lock
+        # Exclusive lockers in this process queue on a threading.Lock first, so
+        # they are handed the lock directly instead of polling the lock file
+        self._thread_lock = None if shared else _thread_lock_for(filepath)
+        self._thread_lock_held = False
 
     def __enter__(self):
         """Acquire file lock."""
         start_time = time.time()
 
-        # Ensure target file exists
-        if not os.path.exists(self.filepath):
-            with open(self.filepath, "w") as f:
-                json.dump({}, f)
+        if self._thread_lock is not None:
+            if not self._thread_lock.acquire(timeout=self.timeout):
+                raise TimeoutError(
+                    f"Could not acquire lock on {self.filepath} within {self.timeout} seconds"
+                )
+            self._thread_lock_held = True
+        try:
+            return self._acquire(start_time)
+        except BaseException:
+            self._release_thread_lock()
+            raise
+
+    def _release_thread_lock(self):
+        """Release the in-process lock, if held."""
+        if self._thread_lock_held:
+            self._thread_lock_held = False
+            self._thread_lock.release()
+
+    def _next_wait(self, wait):
+        """
+        Sleep before the next lock attempt with exponential backoff.
+
+        Args:
+            wait: Previous wait in seconds (0 for the first retry)
+
+        Returns:
+            Wait used this time
+        """
+        wait = min(max(wait * 2, _MIN_RETRY_INTERVAL), self.retry_interval)
+        time.sleep(wait)
+        return wait
+
+    def _acquire(self, start_time):
+        """
+        Acquire the cross-process lock (flock() or an exclusive lock file).
+
+        Args:
+            start_time: Time the acquisition started (for timeout)
+        """
+        if self.lock_dir not in _lock_dirs:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            _lock_dirs.add(self.lock_dir)
+
+        if fcntl is not None:
+            return self._acquire_flock(start_time)
 
         # Try to acquire lock
+        wait = 0
         while True:
             try:
                 # Try to create lock file exclusively
                 # On Windows, opening in 'x' mode will fail if file exists
-                # On Unix, we can use os.open with O_CREAT | O_EXCL
                 if platform.system() == "Windows":
                     try:
                         self.lock_file_handle = open(self.lock_filepath, "x")
@@ -55,7 +214,7 @@ class FileLock:
                         # Lock file exists, wait and retry
                         pass
                 else:
-                    # Unix: use O_CREAT | O_EXCL for atomic file creation
+                    # Other platforms: use O_CREAT | O_EXCL for atomic file creation
                     try:
                         fd = os.open(
                             self.lock_filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY
@@ -69,6 +228,8 @@ class FileLock:
                         # Lock file exists, wait and retry
                         pass
 
+                self._remove_stale_lock_file()
+
                 # Check timeout
                 if time.time() - start_time >= self.timeout:
                     raise TimeoutError(
@@ -76,7 +237,7 @@ class FileLock:
                     )
 
                 # Wait before retrying
-                time.sleep(self.retry_interval)
+                wait = self._next_wait(wait)
 
             except Exception as e:
                 if isinstance(e, TimeoutError):
@@ -86,16 +247,82 @@ class FileLock:
                     raise TimeoutError(
                         f"Could not acquire lock on {self.filepath} within {self.timeout} seconds"
                     )
-                time.sleep(self.retry_interval)
+                wait = self._next_wait(wait)
+
+    def _remove_stale_lock_file(self):
+        """
+        Remove the lock file if it is older than STALE_LOCK_SECONDS, which
+        means its holder crashed without releasing it. Only plain lock files
+        can go stale; flock() locks are released by the kernel.
+        """
+        import logging
+
+        try:
+            lock_age = time.time() - os.path.getmtime(self.lock_filepath)
+            if lock_age > STALE_LOCK_SECONDS:
+                logging.warning(
+                    f"Stale lock file detected (age: {lock_age:.1f}s), removing it"
+                )
+                os.remove(self.lock_filepath)
+        except OSError:
+            pass
+
+    def _acquire_flock(self, start_time):
+        """
+        Acquire a shared or exclusive flock() on the lock file.
+        The lock file is kept on disk; the kernel drops the lock when the
+        holder closes it or exits, so it can never go stale.
+
+        Args:
+            start_time: Time the acquisition started (for timeout)
+        """
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        fd = os.open(self.lock_filepath, os.O_CREAT | os.O_RDWR, 0o644)
+        wait = 0
+        while True:
+            try:
+                fcntl.flock(fd, mode | fcntl.LOCK_NB)
+                self.lock_file_handle = os.fdopen(fd, "r+")
+                # Lock acquired
+                return self
+            except BlockingIOError:
+                # Held by a conflicting locker, wait and retry
+                pass
+            except Exception:
+                os.close(fd)
+                raise
+
+            # Check timeout
+            if time.time() - start_time >= self.timeout:
+                os.close(fd)
+                raise TimeoutError(
+                    f"Could not acquire lock on {self.filepath} within {self.timeout} seconds"
+                )
+
+            # Wait before retrying
+            wait = self._next_wait(wait)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Release file lock."""
+        try:
+            self._release_file_lock()
+        finally:
+            self._release_thread_lock()
+
+    def _release_file_lock(self):
+        """Release the cross-process lock."""
         if self.lock_file_handle:
             try:
+                # Closing the descriptor also drops any flock()
                 self.lock_file_handle.close()
             except:
                 pass
 
+        if fcntl is not None:
+            # Keep the lock file: removing it while another process waits on
+            # it would let two holders lock different inodes
+            return
+
         # Remove lock file
         try:
             if os.path.exists(self.lock_filepath):
@@ -104,113 +331,152 @@ class FileLock:
             pass
 
 
-def safe_read_json(filepath):
+def file_signature(filepath):
     """
-    Safely read JSON file with locking.
+    Get a cheap change signature for a file, for caches keyed on its contents.
 
     Args:
-        filepath: Path to JSON file
+        filepath: Path to file
 
     Returns:
-        Dictionary containing JSON data
+        Tuple of (mtime_ns, size) or None if the file doesn't exist
     """
     try:
-        with FileLock(filepath, timeout=5):  # Reduced timeout for faster failure
-            if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-                try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        # Ensure we return a dict, not None
-                        return data if isinstance(data, dict) else {}
-                except json.JSONDecodeError as e:
-                    # Log JSON decode errors
-                    import logging
-
-                    logging.error(f"JSON decode error in {filepath}: {e}")
-                    return {}
-        return {}
-    except Exception as e:
-        # If lock acquisition fails, try reading directly as fallback
-        import logging
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def read_json_unlocked(filepath):
+    """
+    Read JSON file without locking. Caller must hold the FileLock.
+
+    Args:
+        filepath: Path to JSON file
 
-        lock_filepath = filepath + ".lock"
+    Returns:
+        Dictionary containing JSON data (empty if missing or invalid)
+    """
+    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+        try:
+            with open(filepath, "rb") as f:
+                data = load_json_file(f)
+                return data if isinstance(data, dict) else {}
+        except ValueError:  # includes JSONDecodeError
+            return {}
+    return {}
 
-        # Check if lock file is stale (older than 30 seconds)
+
+def write_json_unlocked(filepath, data):
+    """
+    Write JSON file without locking. Caller must hold the FileLock.
+    The data goes to a temporary file that then replaces filepath, so readers
+    and crashes only ever see the old or the new complete file.
+
+    Args:
+        filepath: Path to JSON file
+        data: Dictionary to write
+    """
+    payload = dumps_json(data, indent=True)
+    tmp_filepath = f"{filepath}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_filepath, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp_filepath, filepath)
+    except BaseException:
         try:
-            if os.path.exists(lock_filepath):
-                lock_age = time.time() - os.path.getmtime(lock_filepath)
-                if lock_age > 30:  # Lock file older than 30 seconds is considered stale
-                    logging.warning(
-                        f"Stale lock file detected (age: {lock_age:.1f}s), removing it"
-                    )
-                    try:
-                        os.remove(lock_filepath)
-                    except:
-                        pass
-        except:
+            os.remove(tmp_filepath)
+        except OSError:
             pass
+        raise
 
-        # Always try direct read if lock fails (for read operations, it's safe)
-        logging.warning(
-            f"Lock acquisition failed for {filepath}, trying direct read: {e}"
-        )
+
+def _replace(src, dst):
+    """
+    os.replace() src over dst, retrying briefly on Windows while dst is open
+    elsewhere. POSIX replaces open files, so it is never retried there.
+
+    Args:
+        src: Path of the new file
+        dst: Path to replace
+    """
+    wait = 0.01
+    for attempt in range(REPLACE_ATTEMPTS):
         try:
-            if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    result = data if isinstance(data, dict) else {}
-                    logging.info(
-                        f"Direct read successful for {filepath}, got {len(result)} entries"
-                    )
-                    return result
-        except Exception as direct_e:
-            logging.error(
-                f"Direct read also failed for {filepath}: {direct_e}", exc_info=True
-            )
-        return {}
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if os.name != "nt" or attempt == REPLACE_ATTEMPTS - 1:
+                raise
+            time.sleep(wait)
+            wait *= 2
 
 
-def safe_write_json(filepath, data):
+def safe_read_json(filepath):
     """
-    Safely write JSON file with locking.
+    Safely read JSON file.
+    Where flock() is available (POSIX) no lock is taken: writers replace the
+    file atomically (see write_json_unlocked), and os.replace() works while
+    readers have the file open, so a reader always sees a complete file.
+    Elsewhere (Windows) os.replace() fails over an open file, so readers
+    still take the FileLock to keep out of writers' way.
 
     Args:
         filepath: Path to JSON file
-        data: Dictionary to write
+
+    Returns:
+        Dictionary containing JSON data (empty if missing or invalid)
     """
-    with FileLock(filepath):
-        with open(filepath, "w") as f:
-            json.dump(data, f, indent=2)
+    if fcntl is None:
+        try:
+            with FileLock(filepath, timeout=5, shared=True):
+                return _read_json_file(filepath)
+        except TimeoutError as e:
+            import logging
 
+            logging.warning(
+                f"Lock acquisition failed for {filepath}, trying direct read: {e}"
+            )
+    return _read_json_file(filepath)
 
-def safe_merge_json(filepath, new_data):
+
+def _read_json_file(filepath):
     """
-    Safely merge new data into existing JSON file with locking.
-    Preserves existing data and only updates/adds new entries.
+    Read a JSON file without locking.
 
     Args:
         filepath: Path to JSON file
-        new_data: Dictionary with new/updated entries
 
     Returns:
-        Updated dictionary
+        Dictionary containing JSON data (empty if missing or invalid)
     """
-    with FileLock(filepath):
-        # Read existing data
-        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-            try:
-                with open(filepath, "r") as f:
-                    existing_data = json.load(f)
-            except (json.JSONDecodeError, ValueError):
-                existing_data = {}
-        else:
-            existing_data = {}
+    try:
+        with open(filepath, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return {}
+            data = load_json_file(f)
+            # Ensure we return a dict, not None
+            return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:  # includes JSONDecodeError
+        # Log JSON decode errors
+        import logging
+
+        logging.error(f"JSON decode error in {filepath}: {e}")
+        return {}
 
-        # Merge new data
-        existing_data.update(new_data)
 
-        # Write back
-        with open(filepath, "w") as f:
-            json.dump(existing_data, f, indent=2)
+def safe_write_json(filepath, data):
+    """
+    Safely write JSON file with locking.
 
-        return existing_data
+    Args:
+        filepath: Path to JSON file
+        data: Dictionary to write
+    """
+    with FileLock(filepath):
+        write_json_unlocked(filepath, data)
@@ -0,0 +1,585 @@
+"""
+In-process cache for per-site labels files.
+
+Label edits are appended to a journal (labels.jsonl) next to labels.json
+instead of rewriting the whole file on every save. The journal is folded back
+into labels.json once it outgrows it, and at startup. Parsed labels are reused
+until either file changes; journal growth is replayed incrementally.
+"""
+
+import os
+import threading
+from bisect import bisect_left
+from file_lock import (
+    FileLock,
+    dumps_json,
+    file_signature,
+    loads_json,
+    read_json_unlocked,
+    write_json_unlocked,
+)
+
+# Journal size (bytes) that triggers compaction into labels.json; compaction
+# also waits until the journal is at least as large as labels.json itself
+JOURNAL_COMPACT_MIN_BYTES = 256 * 1024
+
+# labels_file -> {"snapshot": (mtime_ns, size) of labels.json,
+#                 "journal": (mtime_ns, size) of labels.jsonl,
+#                 "offset": journal bytes replayed into "labels",
+#                 "labels": dict,
+#                 "labeled": set of labeled filenames,
+#                 "sorted_keys": filenames in sorted order,
+#                 "unreviewed_keys": sorted filenames without an admin review}
+# Derived fields are None until first requested for that labels version.
+_labels_cache = {}
+
+# labels_file -> threading.Lock serializing this process's writers to that file
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+# labels_file -> updates waiting for that file's write lock. Whoever gets the
+# lock applies every queued update and writes the file once for all of them.
+_pending_updates = {}
+
+
+def _write_lock_for(labels_file):
+    """
+    Get the in-process write lock for a labels file.
+    Writers to the same site queue on this lock and are handed off directly,
+    instead of polling the lock file; writers to other sites never contend.
+
+    Args:
+        labels_file: Path to labels.json
+
+    Returns:
+        threading.Lock for the file
+    """
+    lock = _write_locks.get(labels_file)
+    if lock is None:
+        with _write_locks_guard:
+            lock = _write_locks.setdefault(labels_file, threading.Lock())
+    return lock
+
+
+def is_labeled(label_data):
+    """
+    Check if image is labeled (handles both flat and nested formats).
+
+    Args:
+        label_data: Either a string (old format) or dict (new format)
+
+    Returns:
+        True if labeled, False otherwise
+    """
+    data_type = type(label_data)
+    if data_type is dict:
+        return "value" in label_data
+    if data_type is str:
+        return True  # Any string value means labeled (including "__NULL__")
+    return False
+
+
+def is_reviewed(label_data):
+    """
+    Check if a label has an admin review status.
+
+    Args:
+        label_data: Either a string (old format) or dict (new format)
+
+    Returns:
+        True if an admin marked it sure/not sure
+    """
+    if type(label_data) is not dict:
+        return False
+    admin_review = label_data.get("admin_review")
+    return bool(admin_review and admin_review.get("status"))
+
+
+def journal_path(labels_file):
+    """
+    Get the path of the edit journal kept next to a labels file.
+
+    Args:
+        labels_file: Path to labels.json
+
+    Returns:
+        Path to labels.jsonl
+    """
+    return os.path.splitext(labels_file)[0] + ".jsonl"
+
+
+def _read_journal(journal_file, offset):
+    """
+    Read complete journal records starting at a byte offset.
+    A trailing partial line (an append cut short) is left for later.
+
+    Args:
+        journal_file: Path to labels.jsonl
+        offset: Byte offset to start reading from
+
+    Returns:
+        Tuple of (list of records, offset just past the last complete line)
+    """
+    try:
+        with open(journal_file, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].splitlines():
+        if not line:
+            continue
+        try:
+            records.append(loads_json(line))
+        except ValueError as e:
+            import logging
+
+            logging.error(f"Skipping bad record in {journal_file}: {e}")
+    return records, offset + end
+
+
+def _apply_records(labels, records):
+    """
+    Replay journal records onto a labels dict in place.
+    A record is [filename, label] to set a label or [filename] to remove it.
+
+    Args:
+        labels: Labels dictionary to modify
+        records: Records in journal order
+
+    Returns:
+        List of filenames touched
+    """
+    changed = []
+    for record in records:
+        if type(record) is not list or not record:
+            continue
+        key = record[0]
+        if len(record) > 1:
+            labels[key] = record[1]
+        else:
+            labels.pop(key, None)
+        changed.append(key)
+    return changed
+
+
+def _load_entry(labels_file, entry):
+    """
+    Build an up-to-date cache entry, replaying only new journal records when
+    labels.json itself hasn't changed. Caller should hold the FileLock.
+
+    Args:
+        labels_file: Path to labels.json
+        entry: Previous cache entry for the file, or None
+
+    Returns:
+        Cache entry dict
+    """
+    journal_file = journal_path(labels_file)
+    snapshot = file_signature(labels_file)
+    journal = file_signature(journal_file)
+    if (
+        entry is not None
+        and entry["snapshot"] == snapshot
+        and entry["journal"] == journal
+    ):
+        return entry
+
+    journal_size = journal[1] if journal is not None else 0
+    if (
+        entry is not None
+        and entry["snapshot"] == snapshot
+        and journal_size >= entry["offset"]
+    ):
+        # Only the journal grew: replay its tail onto a copy of the cached labels
+        records, offset = _read_journal(journal_file, entry["offset"])
+        labels = entry["labels"]
+        labeled = entry["labeled"]
+        sorted_keys = entry["sorted_keys"]
+        unreviewed_keys = entry["unreviewed_keys"]
+        if records:
+            labels = dict(labels)
+            changed = _apply_records(labels, records)
+            labeled, sorted_keys = _refresh_derived(
+                labeled, sorted_keys, labels, changed
+            )
+            unreviewed_keys = None
+    else:
+        labels = read_json_unlocked(labels_file)
+        records, offset = _read_journal(journal_file, 0)
+        _apply_records(labels, records)
+        labeled = sorted_keys = unreviewed_keys = None
+
+    return {
+        "snapshot": snapshot,
+        "journal": journal,
+        "offset": offset,
+        "labels": labels,
+        "labeled": labeled,
+        "sorted_keys": sorted_keys,
+        "unreviewed_keys": unreviewed_keys,
+    }
+
+
+def _get_entry(labels_file):
+    """
+    Get the cache entry for a labels file, re-reading it if it changed.
+
+    Args:
+        labels_file: Path to labels.json
+
+    Returns:
+        Cache entry dict, or None if neither labels.json nor its journal exists
+    """
+    snapshot = file_signature(labels_file)
+    journal = file_signature(journal_path(labels_file))
+    if snapshot is None and journal is None:
+        return None
+
+    entry = _labels_cache.get(labels_file)
+    if (
+        entry is not None
+        and entry["snapshot"] == snapshot
+        and entry["journal"] == journal
+    ):
+        return entry
+
+    try:
+        # Readers share the lock; only writers are exclusive
+        with FileLock(labels_file, timeout=5, shared=True):
+            entry = _load_entry(labels_file, entry)
+    except (TimeoutError, OSError) as e:
+        import logging
+
+        logging.warning(
+            f"Lock acquisition failed for {labels_file}, trying direct read: {e}"
+        )
+        entry = _load_entry(labels_file, entry)
+    _labels_cache[labels_file] = entry
+    return entry
+
+
+def read_labels(labels_file):
+    """
+    Read labels for a site, reusing the parsed dict while the file is unchanged.
+
+    Args:
+        labels_file: Path to labels.json
+
+    Returns:
+        Dictionary of labels. It is shared with other callers and must not be
+        mutated; copy it first if changes are needed.
+    """
+    entry = _get_entry(labels_file)
+    return entry["labels"] if entry is not None else {}
+
+
+def get_labeled_keys(labels_file):
+    """
+    Get the set of labeled filenames for a site.
+    Built once per labels version, so completion checks are set operations.
+
+    Args:
+        labels_file: Path to labels.json
+
+    Returns:
+        Set of filenames that have a label (shared, do not mutate)
+    """
+    entry = _get_entry(labels_file)
+    if entry is None:
+        return set()
+    if entry["labeled"] is None:
+        # is_labeled() inlined: this runs over every label on a cache rebuild
+        entry["labeled"] = {
+            key
+            for key, value in entry["labels"].items()
+            if type(value) is str or (type(value) is dict and "value" in value)
+        }
+    return entry["labeled"]
+
+
+def read_sorted_labels(labels_file, hide_reviewed=False):
+    """
+    Read labels for a site together with its filenames in sorted order.
+    The sorted lists are built once per labels version.
+
+    Args:
+        labels_file: Path to labels.json
+        hide_reviewed: Leave out filenames that already have an admin review
+
+    Returns:
+        Tuple of (labels dict, sorted list of filenames); both shared, do not mutate
+    """
+    entry = _get_entry(labels_file)
+    if entry is None:
+        return {}, []
+    labels = entry["labels"]
+    if entry["sorted_keys"] is None:
+        entry["sorted_keys"] = sorted(labels)
+    if not hide_reviewed:
+        return labels, entry["sorted_keys"]
+    if entry["unreviewed_keys"] is None:
+        entry["unreviewed_keys"] = [
+            key for key in entry["sorted_keys"] if not is_reviewed(labels[key])
+        ]
+    return labels, entry["unreviewed_keys"]
+
+
+def _update_sorted_keys(sorted_keys, labels, changed_keys):
+    """
+    Bring a sorted filename list up to date after some keys changed.
+
+    Args:
+        sorted_keys: Sorted filenames before the update (shared, not modified)
+        labels: Labels dictionary after the update
+        changed_keys: Keys that may have been added or removed
+
+    Returns:
+        Sorted filenames for the updated labels; the same list if no key was
+        added or removed
+    """
+    updated = sorted_keys
+    for key in changed_keys:
+        idx = bisect_left(updated, key)
+        present = idx < len(updated) and updated[idx] == key
+        if present == (key in labels):
+            continue
+        # Copy before the first change; readers may still hold the old list
+        if updated is sorted_keys:
+            updated = list(sorted_keys)
+        if present:
+            del updated[idx]
+        else:
+            updated.insert(idx, key)
+    return updated
+
+
+def _refresh_derived(labeled, sorted_keys, labels, changed_keys):
+    """
+    Update cached derived fields after some keys changed.
+
+    Args:
+        labeled: Labeled filename set before the change, or None
+        sorted_keys: Sorted filenames before the change, or None
+        labels: Labels dictionary after the change
+        changed_keys: Keys that may have changed
+
+    Returns:
+        Tuple of (labeled set or None, sorted filenames or None); new objects
+        if anything changed, since readers may still hold the old ones
+    """
+    if labeled is not None:
+        labeled = set(labeled)
+        for key in changed_keys:
+            if is_labeled(labels.get(key)):
+                labeled.add(key)
+            else:
+                labeled.discard(key)
+    if sorted_keys is not None:
+        sorted_keys = _update_sorted_keys(sorted_keys, labels, changed_keys)
+    return labeled, sorted_keys
+
+
+def _append_journal(labels_file, labels, changed_keys, offset):
+    """
+    Append the current value of each changed key to the journal.
+    Caller must hold the FileLock.
+
+    Args:
+        labels_file: Path to labels.json
+        labels: Labels dictionary after the update
+        changed_keys: Keys to record
+        offset: Journal bytes known to hold complete records
+
+    Returns:
+        Journal size after the append
+    """
+    journal_file = journal_path(labels_file)
+    lines = []
+    for key in dict.fromkeys(changed_keys):
+        record = [key, labels[key]] if key in labels else [key]
+        lines.append(dumps_json(record))
+    if not lines:
+        return offset
+    data = b"\n".join(lines) + b"\n"
+
+    with open(journal_file, "ab") as f:
+        # Drop a partial record left by an interrupted append
+        if f.tell() != offset:
+            f.truncate(offset)
+        f.write(data)
+        # Saves are acknowledged once appended, so make them as durable as
+        # a full labels.json rewrite
+        f.flush()
+        os.fsync(f.fileno())
+    return offset + len(data)
+
+
+def _compact(labels_file, labels):
+    """
+    Write the full labels to labels.json and empty the journal.
+    labels.json is replaced atomically (see write_json_unlocked), so a crash
+    leaves either the old snapshot plus journal or the new snapshot. Caller
+    must hold the FileLock.
+
+    Args:
+        labels_file: Path to labels.json
+        labels: Full labels dictionary
+    """
+    write_json_unlocked(labels_file, labels)
+    try:
+        os.truncate(journal_path(labels_file), 0)
+    except FileNotFoundError:
+        pass
+
+
+def _store_entry(labels_file, offset, labels, labeled, sorted_keys):
+    """
+    Cache the labels just written. Caller must hold the FileLock, so the file
+    signatures match this write.
+
+    Args:
+        labels_file: Path to labels.json
+        offset: Journal bytes replayed into labels
+        labels: Labels dictionary (must not be mutated afterwards)
+        labeled: Labeled filename set, or None
+        sorted_keys: Sorted filenames, or None
+    """
+    _labels_cache[labels_file] = {
+        "snapshot": file_signature(labels_file),
+        "journal": file_signature(journal_path(labels_file)),
+        "offset": offset,
+        "labels": labels,
+        "labeled": labeled,
+        "sorted_keys": sorted_keys,
+        "unreviewed_keys": None,
+    }
+
+
+def _apply_pending_updates(labels_file, batch):
+    """
+    Apply a batch of queued updates with a single locked read and write.
+    Caller must hold the file's write lock. Each update dict gets its result
+    or error filled in and is marked done.
+
+    Args:
+        labels_file: Path to labels.json
+        batch: List of pending update dicts, in arrival order
+    """
+    try:
+        with FileLock(labels_file):
+            entry = _load_entry(labels_file, _labels_cache.get(labels_file))
+            labels = dict(entry["labels"])
+            applied = []
+            for update in batch:
+                try:
+                    update["updater"](labels)
+                except Exception as e:
+                    update["error"] = e
+                    # Start over so a failed updater's partial changes
+                    # aren't written
+                    labels = dict(entry["labels"])
+                    for done in applied:
+                        done["updater"](labels)
+                    continue
+                applied.append(update)
+            if not applied:
+                return
+
+            changed_keys = []
+            for update in applied:
+                if update["changed_keys"] is None:
+                    changed_keys = None
+                    break
+                changed_keys.extend(update["changed_keys"])
+
+            if changed_keys is None or entry["snapshot"] is None:
+                # Unknown changes or no labels.json yet: write the whole file
+                _compact(labels_file, labels)
+                offset = 0
+                labeled = sorted_keys = None
+            else:
+                offset = _append_journal(
+                    labels_file, labels, changed_keys, entry["offset"]
+                )
+                snapshot_size = entry["snapshot"][1] if entry["snapshot"] else 0
+                if offset >= max(JOURNAL_COMPACT_MIN_BYTES, snapshot_size):
+                    _compact(labels_file, labels)
+                    offset = 0
+                labeled, sorted_keys = _refresh_derived(
+                    entry["labeled"], entry["sorted_keys"], labels, changed_keys
+                )
+
+            _store_entry(labels_file, offset, labels, labeled, sorted_keys)
+            for update in applied:
+                update["result"] = labels
+    except Exception as e:
+        # Lock timeout or failed write: none of the batch was saved
+        for update in batch:
+            if update["error"] is None:
+                update["error"] = e
+    finally:
+        for update in batch:
+            update["done"] = True
+
+
+def update_labels(labels_file, updater, changed_keys=None):
+    """
+    Apply an in-place update to a labels file under its lock and refresh the cache.
+    The read, update and write happen atomically with respect to other writers.
+    Updates that queue up behind a write in progress are applied together and
+    written once; each call still returns only after its update is on disk.
+
+    Args:
+        labels_file: Path to labels.json
+        updater: Callable receiving a private labels dict to modify in place.
+            It may be called more than once if another update in the same
+            batch fails, so it should only set values.
+        changed_keys: Optional iterable of the keys the updater touches. When
+            given, the labeled set and sorted filename index are updated
+            incrementally instead of being rebuilt on next use.
+
+    Returns:
+        Updated labels dictionary (shared, do not mutate)
+    """
+    update = {
+        "updater": updater,
+        "changed_keys": tuple(changed_keys) if changed_keys is not None else None,
+        "done": False,
+        "result": None,
+        "error": None,
+    }
+    with _write_locks_guard:
+        _pending_updates.setdefault(labels_file, []).append(update)
+
+    with _write_lock_for(labels_file):
+        # A previous lock holder may already have written this update
+        if not update["done"]:
+            with _write_locks_guard:
+                batch = _pending_updates.pop(labels_file)
+            _apply_pending_updates(labels_file, batch)
+
+    if update["error"] is not None:
+        raise update["error"]
+    return update["result"]
+
+
+def compact_labels(labels_file):
+    """
+    Fold a labels file's journal into labels.json, if it has one.
+
+    Args:
+        labels_file: Path to labels.json
+    """
+    with _write_lock_for(labels_file), FileLock(labels_file):
+        journal = file_signature(journal_path(labels_file))
+        if journal is None or journal[1] == 0:
+            return
+        entry = _load_entry(labels_file, _labels_cache.get(labels_file))
+        _compact(labels_file, entry["labels"])
+        _store_entry(
+            labels_file, 0, entry["labels"], entry["labeled"], entry["sorted_keys"]
+        )
@@ -3,6 +3,60 @@ Site discovery and management for multi-site captcha labeling.
 """
 
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import NamedTuple
+
+# Seconds a discovered site list is reused before rescanning
+SITES_CACHE_TTL = 5.0
+
+# Check site folders for an 'img' folder concurrently. Only worth it when
+# base_dir is on network storage (NFS/SMB), where every stat() is a round trip.
+PARALLEL_DISCOVERY = os.environ.get("CAPTCHA_PARALLEL_DISCOVERY") == "1"
+_discovery_pool = ThreadPoolExecutor(max_workers=16) if PARALLEL_DISCOVERY else None
+
+# base_dir -> (timestamp, base_dir mtime_ns, list of site IDs)
+_sites_cache = {}
+
+
+def iter_sites(base_dir):
+    """
+    Yield sites from base directory as they are found, in directory order.
+    A site is a subdirectory that contains an 'img' folder.
+
+    Args:
+        base_dir: Base directory containing site folders
+
+    Yields:
+        Site IDs (folder names)
+    """
+    try:
+        entries = os.scandir(base_dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+    # Bound once instead of looked up on every entry
+    join = os.path.join
+    isdir = os.path.isdir
+
+    # DirEntry.is_dir() uses the file type from the directory listing, so
+    # plain directories and files don't need a stat() each
+    with entries:
+        if _discovery_pool is not None:
+            folders = [entry for entry in entries if entry.is_dir()]
+        else:
+            for entry in entries:
+                if entry.is_dir():
+                    # isdir() is False for missing paths too, so one stat() will do
+                    if isdir(join(entry.path, "img")):
+                        yield entry.name
+            return
+
+    img_dirs = (join(entry.path, "img") for entry in folders)
+    for entry, has_img in zip(folders, _discovery_pool.map(isdir, img_dirs)):
+        if has_img:
+            yield entry.name
 
 
 def get_sites(base_dir):
@@ -10,46 +64,88 @@ def get_sites(base_dir):
     Discover sites from base directory.
     A site is a subdirectory that contains an 'img' folder.
 
+    Args:
+        base_dir: Base directory containing site folders
+
+    Returns:
+        Sorted list of site IDs (folder names)
+    """
+    return sorted(iter_sites(base_dir))
+
+
+def get_cached_sites(base_dir):
+    """
+    Get sites from base directory, reusing a recent scan.
+    The site list is rescanned as soon as a folder is added to or removed
+    from base_dir (its mtime changes), and otherwise at most once every
+    SITES_CACHE_TTL seconds, which picks up 'img' folders created inside
+    existing folders.
+
     Args:
         base_dir: Base directory containing site folders
 
     Returns:
         List of site IDs (folder names)
     """
-    sites = []
-    if not os.path.exists(base_dir):
-        return sites
+    now = time.monotonic()
+    try:
+        mtime_ns = os.stat(base_dir).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    cached = _sites_cache.get(base_dir)
+    if (
+        cached is not None
+        and cached[1] == mtime_ns
+        and now - cached[0] < SITES_CACHE_TTL
+    ):
+        return cached[2]
+
+    sites = get_sites(base_dir)
+    _sites_cache[base_dir] = (now, mtime_ns, sites)
+    return sites
 
-    for item in os.listdir(base_dir):
-        site_path = os.path.join(base_dir, item)
-        if os.path.isdir(site_path):
-            img_dir = os.path.join(site_path, "img")
-            if os.path.exists(img_dir) and os.path.isdir(img_dir):
-                sites.append(item)
 
-    return sorted(sites)
+class SitePaths(NamedTuple):
+    """Paths of a site's folder and the files kept in it."""
 
+    base: str  # site base path
+    img: str  # image directory path
+    labels: str  # labels.json path
+    buckets: str  # buckets.json path
+    bucket_images: str  # bucket_images.json path
 
+
+@lru_cache(maxsize=256)
 def get_site_paths(base_dir, site_id):
     """
     Get paths for a specific site.
+    Results are memoized (SitePaths is immutable, so they can be shared).
 
     Args:
         base_dir: Base directory containing site folders
         site_id: Site identifier (folder name)
 
     Returns:
-        Dictionary with paths: {
-            'base': site base path,
-            'img': image directory path,
-            'labels': labels.json path,
-            'buckets': buckets.json path
-        }
+        SitePaths with base, img, labels, buckets and bucket_images paths
+
+    Raises:
+        ValueError: If site_id isn't a single folder name (it comes from
+            request arguments, so this keeps paths inside base_dir)
     """
+    if (
+        not site_id
+        or site_id in (".", "..")
+        or os.sep in site_id
+        or (os.altsep and os.altsep in site_id)
+        or "\0" in site_id
+    ):
+        raise ValueError(f"Invalid site id: {site_id!r}")
+
     site_base = os.path.join(base_dir, site_id)
-    return {
-        "base": site_base,
-        "img": os.path.join(site_base, "img"),
-        "labels": os.path.join(site_base, "labels.json"),
-        "buckets": os.path.join(site_base, "buckets.json"),
-    }
+    return SitePaths(
+        base=site_base,
+        img=os.path.join(site_base, "img"),
+        labels=os.path.join(site_base, "labels.json"),
+        buckets=os.path.join(site_base, "buckets.json"),
+        bucket_images=os.path.join(site_base, "bucket_images.json"),
+    )